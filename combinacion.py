@@ -0,0 +1,191 @@
+"""
+Motor de combinacion de reportes de distintas cuentas
+Alinea las columnas por nombre de encabezado (no por posicion), rellena las que faltan,
+unifica variantes del mismo encabezado y agrega columnas de procedencia en una sola pasada
+"""
+
+import os
+import re
+import sys
+import unicodedata
+from datetime import datetime, date, timedelta
+from tabla_pacientes import (
+    TablaPacientes, ColumnaConstante, ColumnaPorTramos, convertir_columna,
+    TIPO_TEXTO, TIPO_ENTERO, TIPO_DECIMAL, TIPO_FECHA, TIPO_FECHA_HORA, a_texto
+)
+
+# Columnas de procedencia
+COLUMNA_DOCTOR = "Doctor"
+COLUMNA_ARCHIVO = "Archivo Origen"
+COLUMNA_FECHA_REPORTE = "Fecha Reporte"
+
+# Variantes conocidas de un mismo encabezado (ya normalizadas) -> clave comun
+ALIAS_ENCABEZADOS = {
+    'nombre paciente': 'paciente',
+    'nombre del paciente': 'paciente',
+    'nombres': 'paciente',
+    'identificacion': 'documento',
+    'no documento': 'documento',
+    'numero documento': 'documento',
+    'numero de documento': 'documento',
+    'cedula': 'documento',
+    'fecha atencion': 'fecha',
+    'fecha de atencion': 'fecha',
+}
+
+def normalizar_encabezado(nombre):
+    """Clave de comparacion de un encabezado: sin tildes, minusculas y espacios simples"""
+    texto = unicodedata.normalize('NFKD', str(nombre)).encode('ascii', 'ignore').decode('ascii')
+    texto = re.sub(r'[^a-z0-9]+', ' ', texto.lower()).strip()
+    return ALIAS_ENCABEZADOS.get(texto, texto)
+
+def alinear_a_encabezado(tabla, encabezado):
+    """Extiende `encabezado` con las columnas nuevas de la tabla y devuelve (encabezado, indices)
+
+    `indices[i]` es la columna de la tabla que va bajo `encabezado[i]` (None si la tabla no la trae).
+    """
+    conocidas = {normalizar_encabezado(n) for n in encabezado}
+    encabezado = list(encabezado)
+    posiciones = {}
+    for idx, nombre in enumerate(tabla.nombres):
+        clave = normalizar_encabezado(nombre)
+        posiciones.setdefault(clave, idx)
+        if clave not in conocidas:
+            conocidas.add(clave)
+            encabezado.append(nombre)
+    return encabezado, [posiciones.get(normalizar_encabezado(n)) for n in encabezado]
+
+def doctor_de_archivo(archivo):
+    """Extrae el nombre del doctor del archivo (reporte_pacientes_Daniel.xlsx -> Daniel)"""
+    nombre_base = os.path.splitext(os.path.basename(archivo))[0]
+    return nombre_base.split('_')[-1] if '_' in nombre_base else "Desconocido"
+
+def procedencia_de_archivo(archivo, fecha_reporte=None):
+    """Columnas de procedencia de un reporte descargado (por defecto, datos de ayer)"""
+    if fecha_reporte is None:
+        fecha_reporte = (datetime.now() - timedelta(days=1)).date()
+    return {
+        COLUMNA_DOCTOR: doctor_de_archivo(archivo),
+        COLUMNA_ARCHIVO: os.path.basename(archivo),
+        COLUMNA_FECHA_REPORTE: fecha_reporte,
+    }
+
+def _tipo_de_valor(valor):
+    """Tipo de columna para un valor de procedencia"""
+    if isinstance(valor, datetime):
+        return TIPO_FECHA_HORA
+    if isinstance(valor, date):
+        return TIPO_FECHA
+    if isinstance(valor, bool):
+        return TIPO_TEXTO
+    if isinstance(valor, int):
+        return TIPO_ENTERO
+    if isinstance(valor, float):
+        return TIPO_DECIMAL
+    return TIPO_TEXTO
+
+def _a_decimal(valor):
+    """Valor numerico como decimal (para unir columnas enteras y decimales)"""
+    return None if valor is None else float(valor)
+
+class CombinadorTablas:
+    """Acumula tablas una a una alineando columnas por encabezado normalizado
+
+    Cada columna es una ColumnaPorTramos: las columnas de cada archivo se encadenan sin
+    copiarse y la procedencia y los vacios de relleno quedan como tramos constantes.
+    """
+
+    def __init__(self):
+        self.claves = []
+        self.claves_procedencia = []
+        self.nombres = {}
+        self.tipos = {}
+        self.columnas = {}
+        self.con_valores = {}
+        self.filas = 0
+
+    def _extender(self, clave, nombre, tipo, valores, con_valores):
+        """Agrega los valores de una columna, creandola (con vacios previos) si es nueva"""
+        if clave not in self.columnas:
+            self.nombres[clave] = sys.intern(nombre)
+            self.tipos[clave] = tipo
+            self.columnas[clave] = ColumnaPorTramos([ColumnaConstante(None, self.filas)])
+            self.con_valores[clave] = False
+
+        if con_valores and self.tipos[clave] != tipo:
+            if not self.con_valores[clave]:
+                # Hasta ahora la columna solo tenia vacios: adopta el tipo entrante
+                self.tipos[clave] = tipo
+            elif {self.tipos[clave], tipo} == {TIPO_ENTERO, TIPO_DECIMAL}:
+                # Enteros y decimales se unen como decimales
+                if self.tipos[clave] == TIPO_ENTERO:
+                    self.columnas[clave] = self.columnas[clave].convertir(_a_decimal)
+                    self.tipos[clave] = TIPO_DECIMAL
+                else:
+                    valores = convertir_columna(valores, _a_decimal)
+            else:
+                # Tipos incompatibles entre archivos: la columna completa pasa a texto
+                if self.tipos[clave] != TIPO_TEXTO:
+                    self.columnas[clave] = self.columnas[clave].convertir(a_texto)
+                    self.tipos[clave] = TIPO_TEXTO
+                valores = convertir_columna(valores, a_texto)
+
+        self.columnas[clave].extend(valores)
+        self.con_valores[clave] = self.con_valores[clave] or con_valores
+
+    def agregar(self, tabla, procedencia=None):
+        """Agrega una tabla; `procedencia` son columnas constantes (solo si la tabla no las trae)"""
+        if not tabla.nombres:
+            return
+        n = len(tabla)
+        vistas = set()
+
+        for nombre, tipo, valores in zip(tabla.nombres, tabla.tipos, tabla.columnas):
+            clave = normalizar_encabezado(nombre)
+            if clave in vistas:
+                # Encabezado repetido dentro del mismo archivo: se conserva como columna aparte
+                sufijo = 2
+                while f"{clave} {sufijo}" in vistas:
+                    sufijo += 1
+                clave, nombre = f"{clave} {sufijo}", f"{nombre} {sufijo}"
+            vistas.add(clave)
+            if clave not in self.columnas:
+                self.claves.append(clave)
+            self._extender(clave, nombre, tipo, valores, any(v is not None for v in valores))
+
+        for nombre, valor in (procedencia or {}).items():
+            clave = normalizar_encabezado(nombre)
+            if clave in vistas:
+                continue
+            vistas.add(clave)
+            if clave not in self.columnas and clave not in self.claves_procedencia:
+                self.claves_procedencia.append(clave)
+            if isinstance(valor, str):
+                valor = sys.intern(valor)
+            self._extender(clave, nombre, _tipo_de_valor(valor), ColumnaConstante(valor, n), valor is not None)
+
+        # Columnas que este archivo no trae: se rellenan con vacios
+        for clave in self.columnas:
+            if clave not in vistas:
+                self.columnas[clave].extend(ColumnaConstante(None, n))
+
+        self.filas += n
+
+    def tabla(self):
+        """Devuelve la tabla combinada (columnas de datos primero, procedencia al final)"""
+        claves = [c for c in self.claves if c not in self.claves_procedencia] + self.claves_procedencia
+        return TablaPacientes(
+            [self.nombres[c] for c in claves],
+            [self.tipos[c] for c in claves],
+            [self.columnas[c] for c in claves],
+        )
+
+def combinar_tablas(fuentes):
+    """Combina en una sola pasada un iterable de tablas o de pares (tabla, procedencia)"""
+    combinador = CombinadorTablas()
+    for fuente in fuentes:
+        if isinstance(fuente, TablaPacientes):
+            combinador.agregar(fuente)
+        else:
+            combinador.agregar(*fuente)
+    return combinador.tabla()
@@ -0,0 +1,269 @@
+"""
+Script para compactar las hojas diarias del Google Sheet de pacientes
+Mantiene vivas las ultimas N hojas diarias, une las anteriores en hojas mensuales,
+las exporta a archivos locales (Parquet o CSV) por mes y doctor, y borra las hojas viejas
+
+El archivo local se conserva entre ejecuciones de GitHub Actions con actions/cache
+(ver daily-pacientes.yml); la copia de referencia sigue siendo la hoja mensual
+"""
+
+import os
+import re
+import csv
+import logging
+from datetime import datetime
+from upload_to_sheets import obtener_credenciales, leer_hojas_tipadas, EPOCA_SHEETS
+from grabacion import modo, MODO_REPRODUCIR, construir_servicio_sheets
+from tabla_pacientes import TablaPacientes, TIPO_ENTERO, TIPO_DECIMAL, TIPO_FECHA, TIPO_FECHA_HORA, escribir_csv
+from combinacion import combinar_tablas, alinear_a_encabezado, COLUMNA_DOCTOR, COLUMNA_FECHA_REPORTE
+
+# Configurar logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+
+# Configuracion
+DIAS_HOJAS_VIVAS = int(os.environ.get('DIAS_HOJAS_VIVAS', '14'))
+DIRECTORIO_ARCHIVO = os.environ.get('DIRECTORIO_ARCHIVO', 'archivo')
+PATRON_HOJA_DIARIA = re.compile(r'^Pacientes_(\d{4}-\d{2}-\d{2})$')
+COLUMNAS_POR_DEFECTO = 26
+
+def listar_hojas(service, sheet_id):
+    """Devuelve {titulo: propiedades} de todas las hojas del spreadsheet"""
+    meta = service.spreadsheets().get(
+        spreadsheetId=sheet_id,
+        fields='sheets.properties(sheetId,title,gridProperties.columnCount)'
+    ).execute()
+    return {h['properties']['title']: h['properties'] for h in meta.get('sheets', [])}
+
+def seleccionar_hojas_a_compactar(titulos, dias_vivos):
+    """Agrupa por mes las hojas diarias que quedan fuera de las ultimas `dias_vivos`"""
+    diarias = sorted(
+        (m.group(1), t) for t in titulos for m in [PATRON_HOJA_DIARIA.match(t)] if m
+    )
+    viejas = diarias[:-dias_vivos] if dias_vivos > 0 else diarias
+    por_mes = {}
+    for fecha, titulo in viejas:
+        por_mes.setdefault(fecha[:7], []).append((fecha, titulo))
+    return por_mes
+
+def leer_hojas(service, sheet_id, hojas):
+    """Lee varias hojas en una sola llamada y las devuelve como pares (tabla, procedencia)"""
+    filas_por_hoja = leer_hojas_tipadas(service, sheet_id, [titulo for _, titulo in hojas])
+
+    fuentes = []
+    for fecha, titulo in hojas:
+        tabla = TablaPacientes.desde_filas(filas_por_hoja.get(titulo, []))
+        if not tabla.nombres:
+            logging.info(f"Hoja vacia, se descarta: {titulo}")
+            continue
+        # Las hojas anteriores a la columna de procedencia toman la fecha del nombre de la hoja
+        fuentes.append((tabla, {COLUMNA_FECHA_REPORTE: datetime.strptime(fecha, "%Y-%m-%d").date()}))
+    return fuentes
+
+def _celda_sheets(valor, tipo):
+    """CellData de la API con el valor tipado (fechas como numero de serie con formato)"""
+    if valor is None:
+        return {}
+    if tipo == TIPO_FECHA_HORA:
+        return {
+            'userEnteredValue': {'numberValue': (valor - EPOCA_SHEETS).total_seconds() / 86400},
+            'userEnteredFormat': {'numberFormat': {'type': 'DATE_TIME', 'pattern': 'yyyy-mm-dd hh:mm:ss'}}
+        }
+    if tipo == TIPO_FECHA:
+        return {
+            'userEnteredValue': {'numberValue': (valor - EPOCA_SHEETS.date()).days},
+            'userEnteredFormat': {'numberFormat': {'type': 'DATE', 'pattern': 'yyyy-mm-dd'}}
+        }
+    if tipo in (TIPO_ENTERO, TIPO_DECIMAL):
+        return {'userEnteredValue': {'numberValue': valor}}
+    return {'userEnteredValue': {'stringValue': str(valor)}}
+
+def _nuevo_id_hoja(hojas, mes):
+    """sheetId libre para la hoja mensual (se fija aqui para usarlo en la misma peticion)"""
+    usados = {p['sheetId'] for p in hojas.values()}
+    nuevo = int(mes.replace('-', ''))
+    while nuevo in usados:
+        nuevo += 1
+    return nuevo
+
+def solicitudes_hoja_mensual(service, sheet_id, mes, tabla, hojas):
+    """Peticiones batchUpdate que agregan las filas del mes a Pacientes_YYYY-MM, alineadas por encabezado"""
+    titulo = f"Pacientes_{mes}"
+    propiedades = hojas.get(titulo)
+    encabezado = []
+    if propiedades:
+        respuesta = service.spreadsheets().values().get(
+            spreadsheetId=sheet_id,
+            range=f"'{titulo}'!1:1"
+        ).execute()
+        encabezado = (respuesta.get('values') or [[]])[0]
+
+    encabezado_nuevo, indices = alinear_a_encabezado(tabla, encabezado)
+
+    solicitudes = []
+    if propiedades is None:
+        id_hoja = _nuevo_id_hoja(hojas, mes)
+        solicitudes.append({'addSheet': {'properties': {
+            'sheetId': id_hoja,
+            'title': titulo,
+            'gridProperties': {'columnCount': max(len(encabezado_nuevo), COLUMNAS_POR_DEFECTO)}
+        }}})
+        logging.info(f"Nueva hoja mensual: {titulo}")
+    else:
+        id_hoja = propiedades['sheetId']
+        columnas = propiedades.get('gridProperties', {}).get('columnCount', COLUMNAS_POR_DEFECTO)
+        if len(encabezado_nuevo) > columnas:
+            solicitudes.append({'appendDimension': {
+                'sheetId': id_hoja, 'dimension': 'COLUMNS', 'length': len(encabezado_nuevo) - columnas
+            }})
+
+    if encabezado_nuevo != encabezado:
+        logging.info(f"Encabezado de {titulo}: {encabezado_nuevo}")
+        solicitudes.append({'updateCells': {
+            'start': {'sheetId': id_hoja, 'rowIndex': 0, 'columnIndex': 0},
+            'rows': [{'values': [{'userEnteredValue': {'stringValue': n}} for n in encabezado_nuevo]}],
+            'fields': 'userEnteredValue'
+        }})
+
+    filas = [
+        {'values': [_celda_sheets(fila[i], tabla.tipos[i]) if i is not None else {} for i in indices]}
+        for fila in tabla.filas()
+    ]
+    solicitudes.append({'appendCells': {
+        'sheetId': id_hoja,
+        'rows': filas,
+        'fields': 'userEnteredValue,userEnteredFormat.numberFormat'
+    }})
+    return solicitudes
+
+def _nombre_particion(valor):
+    """Limpia un valor para usarlo como nombre de carpeta"""
+    return re.sub(r'[^A-Za-z0-9_-]+', '_', str(valor)).strip('_') or "Desconocido"
+
+def _seleccionar_filas(tabla, indices):
+    """Nueva tabla con solo las filas indicadas"""
+    return TablaPacientes(tabla.nombres, tabla.tipos, [[col[i] for i in indices] for col in tabla.columnas])
+
+def _leer_particion(ruta, pq):
+    """Lee un archivo de particion existente como tabla (Parquet si `pq`, si no CSV)"""
+    if pq is not None:
+        columnas = pq.read_table(ruta).to_pydict()
+        return TablaPacientes.desde_filas([list(columnas)] + [list(f) for f in zip(*columnas.values())])
+    with open(ruta, 'r', encoding='utf-8') as f:
+        return TablaPacientes.desde_filas(list(csv.reader(f)))
+
+def exportar_archivo(tabla, mes, directorio=DIRECTORIO_ARCHIVO):
+    """Exporta la tabla del mes a archivos locales particionados por mes y doctor
+
+    Es idempotente: las filas de las fechas exportadas reemplazan a las que ya habia en la particion.
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        pa = pq = None
+        logging.info("pyarrow no disponible, el archivo se exporta en CSV")
+
+    doctores = tabla.columna(COLUMNA_DOCTOR) if COLUMNA_DOCTOR in tabla.nombres else ["Desconocido"] * len(tabla)
+    indices_por_doctor = {}
+    for idx, doctor in enumerate(doctores):
+        indices_por_doctor.setdefault(doctor or "Desconocido", []).append(idx)
+
+    rutas = []
+    for doctor, indices in indices_por_doctor.items():
+        carpeta = os.path.join(directorio, f"mes={mes}", f"doctor={_nombre_particion(doctor)}")
+        os.makedirs(carpeta, exist_ok=True)
+        ruta = os.path.join(carpeta, "pacientes.parquet" if pq is not None else "pacientes.csv")
+        parte = _seleccionar_filas(tabla, indices)
+
+        if os.path.exists(ruta):
+            existente = _leer_particion(ruta, pq)
+            if COLUMNA_FECHA_REPORTE in existente.nombres:
+                # Un reintento tras un fallo no duplica dias: se quitan las fechas que se vuelven a exportar
+                fechas = set(parte.columna(COLUMNA_FECHA_REPORTE))
+                conservar = [i for i, f in enumerate(existente.columna(COLUMNA_FECHA_REPORTE)) if f not in fechas]
+                existente = _seleccionar_filas(existente, conservar)
+            parte = combinar_tablas([existente, parte])
+
+        if pq is not None:
+            pq.write_table(pa.table({n: list(c) for n, c in zip(parte.nombres, parte.columnas)}), ruta)
+        else:
+            escribir_csv(parte, ruta)
+
+        logging.info(f"Archivo exportado: {ruta} ({len(indices)} filas nuevas, {len(parte)} en total)")
+        rutas.append(ruta)
+    return rutas
+
+def compactar(credentials, sheet_id, dias_vivos=DIAS_HOJAS_VIVAS, directorio=DIRECTORIO_ARCHIVO):
+    """Compacta las hojas diarias antiguas en hojas mensuales y archivos locales
+
+    Devuelve (hojas archivadas, meses que fallaron).
+    """
+    service = construir_servicio_sheets(credentials, 'sheets_compactacion')
+    hojas = listar_hojas(service, sheet_id)
+    por_mes = seleccionar_hojas_a_compactar(hojas, dias_vivos)
+
+    if not por_mes:
+        logging.info(f"No hay hojas diarias fuera de las ultimas {dias_vivos}, nada que compactar")
+        return [], []
+
+    archivadas = []
+    fallidos = []
+    for mes, hojas_mes in sorted(por_mes.items()):
+        logging.info(f"Compactando {len(hojas_mes)} hojas de {mes}...")
+        try:
+            tabla = combinar_tablas(leer_hojas(service, sheet_id, hojas_mes))
+            solicitudes = []
+            if len(tabla):
+                exportar_archivo(tabla, mes, directorio)
+                solicitudes = solicitudes_hoja_mensual(service, sheet_id, mes, tabla, hojas)
+            solicitudes += [{'deleteSheet': {'sheetId': hojas[titulo]['sheetId']}} for _, titulo in hojas_mes]
+
+            # Una sola peticion atomica: o se agregan las filas y se borran las hojas, o no pasa nada
+            service.spreadsheets().batchUpdate(
+                spreadsheetId=sheet_id,
+                body={'requests': solicitudes}
+            ).execute()
+        except Exception as e:
+            # Si falla un mes no se borran sus hojas, se reintentara en la proxima ejecucion
+            logging.error(f"Error compactando {mes}: {e}")
+            fallidos.append(mes)
+            continue
+
+        hojas = listar_hojas(service, sheet_id)
+        archivadas.extend(titulo for _, titulo in hojas_mes)
+        logging.info(f"{mes}: {len(tabla)} filas agregadas, {len(hojas_mes)} hojas diarias borradas")
+
+    return archivadas, fallidos
+
+def main():
+    """Funcion principal"""
+    logging.info("="*60)
+    logging.info("COMPACTACION DE HOJAS DIARIAS")
+    logging.info("="*60)
+
+    try:
+        sheet_id = os.environ.get('GOOGLE_SHEET_ID')
+        if not sheet_id and modo() == MODO_REPRODUCIR:
+            sheet_id = "REPRODUCCION"
+        if not sheet_id:
+            raise ValueError("Variable GOOGLE_SHEET_ID no encontrada")
+
+        credentials = obtener_credenciales()
+        borradas, fallidos = compactar(credentials, sheet_id)
+        # Los meses que fallaron no detienen a los demas, pero la ejecucion debe quedar en rojo
+        if fallidos:
+            raise RuntimeError(f"{len(borradas)} hojas archivadas, fallaron los meses: {', '.join(fallidos)}")
+
+        logging.info("="*60)
+        logging.info(f"COMPACTACION COMPLETADA: {len(borradas)} hojas archivadas")
+        logging.info("="*60)
+
+    except Exception as e:
+        logging.error(f"Error: {e}")
+        exit(1)
+
+if __name__ == "__main__":
+    main()
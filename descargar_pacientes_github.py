@@ -17,7 +17,10 @@ import logging
 import glob
 import shutil
 import base64
-import requests
+from paralelo import mapear_en_paralelo
+from tabla_pacientes import TablaPacientes
+from combinacion import combinar_tablas, procedencia_de_archivo
+from grabacion import modo, MODO_REPRODUCIR, crear_sesion, grabar_archivo, reproducir_archivo
 
 # Configurar logging
 logging.basicConfig(
@@ -135,8 +138,8 @@ def hacer_login(driver, email, password, nombre_cuenta):
 
     logging.info(f"[{nombre_cuenta}] Login completado!")
 
-def descargar_reporte_pacientes(driver, nombre_cuenta):
-    """Navega a la seccion de pacientes atendidos y descarga el reporte"""
+def descargar_reporte_pacientes(driver, nombre_cuenta, fecha=None):
+    """Navega a la seccion de pacientes atendidos y descarga el reporte (por defecto, de ayer)"""
     logging.info(f"[{nombre_cuenta}] Navegando a seccion de pacientes atendidos: {URL_PACIENTES}")
     driver.get(URL_PACIENTES)
 
@@ -153,11 +156,12 @@ def descargar_reporte_pacientes(driver, nombre_cuenta):
         driver.save_screenshot(f"sesion_expirada_{nombre_cuenta}.png")
         raise Exception(f"Sesion expirada para {nombre_cuenta} - redirigido a pagina de login")
 
-    # Calcular fechas: ayer a ayer
-    ayer = datetime.now() - timedelta(days=1)
+    # Calcular fechas: ayer a ayer (o la fecha indicada, ej. hoy en modo sondeo)
+    if fecha is None:
+        fecha = datetime.now() - timedelta(days=1)
 
-    fecha_inicio_str = ayer.strftime("%Y-%m-%d")
-    fecha_fin_str = ayer.strftime("%Y-%m-%d")
+    fecha_inicio_str = fecha.strftime("%Y-%m-%d")
+    fecha_fin_str = fecha.strftime("%Y-%m-%d")
 
     logging.info(f"[{nombre_cuenta}] Rango de fechas: {fecha_inicio_str} a {fecha_fin_str}")
 
@@ -327,7 +331,7 @@ def descargar_reporte_pacientes(driver, nombre_cuenta):
         # === Estrategia 3: Descargar via requests con cookies de Selenium ===
         logging.info(f"[{nombre_cuenta}] Intentando descarga directa via requests...")
         cookies = {c['name']: c['value'] for c in driver.get_cookies()}
-        session = requests.Session()
+        session = crear_sesion('descarga')
         for name, value in cookies.items():
             session.cookies.set(name, value)
         session.headers.update({
@@ -398,46 +402,38 @@ def descargar_reporte_pacientes(driver, nombre_cuenta):
         driver.save_screenshot(f"error_descarga_{nombre_cuenta}.png")
         raise
 
+def _leer_tabla_excel(archivo):
+    """Tarea de cada proceso: lee la hoja activa de un Excel como tabla con su procedencia"""
+    from openpyxl import load_workbook
+
+    logging.info(f"Procesando: {archivo}")
+    try:
+        wb = load_workbook(archivo, read_only=True, data_only=True)
+        # Valores nativos de openpyxl: numeros y fechas conservan su tipo en el combinado
+        filas = list(wb.active.iter_rows(values_only=True))
+        wb.close()
+        logging.info(f"Archivo procesado: {archivo}")
+        return TablaPacientes.desde_filas(filas), procedencia_de_archivo(archivo)
+    except Exception as e:
+        logging.error(f"Error procesando {archivo}: {e}")
+        return TablaPacientes(), None
+
 def combinar_excels(archivos_excel):
-    """Combina multiples archivos Excel en uno solo"""
-    from openpyxl import Workbook, load_workbook
+    """Combina multiples archivos Excel en uno solo, alineando columnas por encabezado"""
+    from openpyxl import Workbook
 
     logging.info(f"Combinando {len(archivos_excel)} archivos Excel...")
 
+    # Los archivos se leen en paralelo; los resultados llegan en orden de nombre de archivo,
+    # el mismo que usa upload_to_sheets para la hoja de Sheets
+    archivos = sorted((a for a in archivos_excel if a is not None), key=os.path.basename)
+    tabla = combinar_tablas(mapear_en_paralelo(_leer_tabla_excel, archivos))
+
     wb_combinado = Workbook()
     ws_combinado = wb_combinado.active
     ws_combinado.title = "Pacientes Combinados"
-
-    fila_actual = 1
-    encabezados_escritos = False
-
-    for archivo in archivos_excel:
-        if archivo is None:
-            continue
-
-        logging.info(f"Procesando: {archivo}")
-
-        try:
-            wb = load_workbook(archivo, data_only=True)
-            ws = wb.active
-
-            for idx, row in enumerate(ws.iter_rows(values_only=True)):
-                # Saltar encabezados en archivos posteriores al primero
-                if idx == 0:
-                    if encabezados_escritos:
-                        continue
-                    else:
-                        encabezados_escritos = True
-
-                for col_idx, valor in enumerate(row, 1):
-                    ws_combinado.cell(row=fila_actual, column=col_idx, value=valor)
-                fila_actual += 1
-
-            wb.close()
-            logging.info(f"Archivo procesado: {archivo}")
-
-        except Exception as e:
-            logging.error(f"Error procesando {archivo}: {e}")
+    for row in tabla.a_filas():
+        ws_combinado.append(row)
 
     # Guardar archivo combinado
     archivo_combinado = os.path.join(DOWNLOAD_DIR, "reporte_pacientes_combinado.xlsx")
@@ -467,11 +463,20 @@ def main():
 
         driver = None
         try:
+            if modo() == MODO_REPRODUCIR:
+                # Sin navegador: se usa el reporte grabado de esta cuenta
+                nombre_archivo = f"reporte_pacientes_{nombre}.xlsx"
+                archivo = reproducir_archivo('descarga', nombre_archivo, os.path.join(DOWNLOAD_DIR, nombre_archivo))
+                archivos_descargados.append(archivo)
+                logging.info(f"[{nombre}] Reporte reproducido desde casete: {archivo}")
+                continue
+
             driver = configurar_chrome()
             hacer_login(driver, email, password, nombre)
             archivo = descargar_reporte_pacientes(driver, nombre)
 
             if archivo:
+                grabar_archivo('descarga', os.path.basename(archivo), archivo)
                 archivos_descargados.append(archivo)
                 logging.info(f"[{nombre}] Descarga completada exitosamente")
             else:
@@ -0,0 +1,250 @@
+"""
+Grabacion y reproduccion de las llamadas HTTP (SUNUBE y Google Sheets)
+Con MODO_GRABACION=grabar guarda los intercambios en casetes JSON sin credenciales;
+con MODO_GRABACION=reproducir los sirve de vuelta para ejecutar los scripts sin red
+"""
+
+import os
+import re
+import json
+import base64
+import atexit
+import hashlib
+import logging
+from datetime import date, timedelta
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+# Configuracion
+# ATENCION: los casetes contienen datos reales de pacientes (xlsx exportados y valores de Sheets).
+# Solo se redactan credenciales; el directorio esta en .gitignore y se crea con permisos 0700.
+# No compartir ni subir casetes fuera de la maquina donde se grabaron.
+DIRECTORIO_CASETES = os.environ.get('DIRECTORIO_CASETES', 'casetes')
+MODO_GRABAR = 'grabar'
+MODO_REPRODUCIR = 'reproducir'
+
+# Solo se guardan estos encabezados de respuesta (cookies y tokens nunca se graban)
+ENCABEZADOS_PERMITIDOS = ['content-type', 'content-disposition', 'location']
+PATRON_PARAMETRO_SENSIBLE = re.compile(r'token|password|clave|key|secret|email|auth', re.IGNORECASE)
+PATRONES_CUERPO_SENSIBLE = [
+    re.compile(r'(name=["\']_token["\']\s+value=["\'])[^"\']*'),
+    re.compile(r'(name=["\']csrf-token["\']\s+content=["\'])[^"\']*'),
+    re.compile(r'("access_token"\s*:\s*")[^"]*'),
+]
+
+# ID del spreadsheet en las URLs de la API (no se graba: la reproduccion no depende de el)
+PATRON_ID_SPREADSHEET = re.compile(r'(/spreadsheets/)[^/?:]+')
+# Nombres de hoja con fecha: lo unico que puede cambiar entre grabacion y reproduccion
+PATRON_HOJA_CON_FECHA = re.compile(r'Pacientes_\d{4}-\d{2}(-\d{2})?')
+PATRON_FECHA = re.compile(r'\d{4}-\d{2}-\d{2}')
+# Metodos cuyo cuerpo (lo que se sube a Sheets) se compara al reproducir
+METODOS_ESCRITURA = {'POST', 'PUT', 'PATCH'}
+
+_casetes = {}
+
+def modo():
+    """Devuelve el modo de grabacion activo ('grabar', 'reproducir' o '')"""
+    return os.environ.get('MODO_GRABACION', '').strip().lower()
+
+def redactar_url(url):
+    """Reemplaza los parametros sensibles de la URL"""
+    partes = urlsplit(PATRON_ID_SPREADSHEET.sub(r'\1SPREADSHEET_ID', url))
+    query = [(k, 'REDACTADO' if PATRON_PARAMETRO_SENSIBLE.search(k) else v)
+             for k, v in parse_qsl(partes.query, keep_blank_values=True)]
+    return urlunsplit((partes.scheme, partes.netloc, partes.path, urlencode(query), ''))
+
+def redactar_cuerpo(contenido, content_type):
+    """Elimina tokens CSRF/OAuth de los cuerpos de texto"""
+    if not any(t in content_type for t in ['text', 'json', 'html', 'xml']):
+        return contenido
+    texto = contenido.decode('utf-8', errors='replace')
+    for patron in PATRONES_CUERPO_SENSIBLE:
+        texto = patron.sub(r'\1REDACTADO', texto)
+    return texto.encode('utf-8')
+
+class Casete:
+    """Lista ordenada de intercambios HTTP guardada en casetes/<nombre>.json"""
+
+    def __init__(self, nombre):
+        self.nombre = nombre
+        self.ruta = os.path.join(DIRECTORIO_CASETES, f"{nombre}.json")
+        self.interacciones = []
+        self.usadas = set()
+        self.fecha = date.today()
+
+        if modo() == MODO_REPRODUCIR:
+            if not os.path.exists(self.ruta):
+                raise FileNotFoundError(f"No existe el casete {self.ruta}, grabe primero con MODO_GRABACION=grabar")
+            with open(self.ruta, 'r', encoding='utf-8') as f:
+                datos = json.load(f)
+            self.interacciones = datos['interacciones']
+            self.fecha = date.fromisoformat(datos['fecha']) if 'fecha' in datos else None
+            logging.info(f"Casete cargado: {self.ruta} ({len(self.interacciones)} interacciones)")
+        elif modo() == MODO_GRABAR:
+            atexit.register(self.guardar)
+
+    def huella_peticion(self, cuerpo):
+        """Huella del cuerpo de una peticion, con las fechas del dia llevadas al dia de la grabacion
+
+        Al reproducir otro dia, hoy y ayer (nombres de hoja, Fecha Reporte) se reemplazan por
+        las fechas equivalentes de la grabacion; ademas se ignora la fecha de los nombres de hoja.
+        """
+        if isinstance(cuerpo, bytes):
+            cuerpo = cuerpo.decode('utf-8', errors='replace')
+        if self.fecha:
+            hoy = date.today()
+            equivalentes = {
+                hoy.isoformat(): self.fecha.isoformat(),
+                (hoy - timedelta(days=1)).isoformat(): (self.fecha - timedelta(days=1)).isoformat(),
+            }
+            cuerpo = PATRON_FECHA.sub(lambda m: equivalentes.get(m.group(0), m.group(0)), cuerpo)
+        cuerpo = PATRON_HOJA_CON_FECHA.sub('Pacientes_FECHA', cuerpo)
+        return hashlib.sha1(cuerpo.encode('utf-8')).hexdigest()
+
+    def grabar(self, metodo, url, estado, encabezados, contenido, cuerpo_peticion=None):
+        """Agrega un intercambio redactado al casete (con la huella del cuerpo si es una escritura)"""
+        encabezados = {k.lower(): v for k, v in encabezados.items() if k.lower() in ENCABEZADOS_PERMITIDOS}
+        contenido = redactar_cuerpo(contenido or b'', encabezados.get('content-type', ''))
+        interaccion = {
+            'metodo': metodo.upper(),
+            'url': redactar_url(url),
+            'estado': estado,
+            'encabezados': encabezados,
+            'cuerpo_b64': base64.b64encode(contenido).decode('ascii'),
+        }
+        if cuerpo_peticion is not None and metodo.upper() in METODOS_ESCRITURA:
+            interaccion['peticion_sha1'] = self.huella_peticion(cuerpo_peticion)
+        self.interacciones.append(interaccion)
+
+    def reproducir(self, metodo, url, cuerpo_peticion=None):
+        """Devuelve (estado, encabezados, contenido) del siguiente intercambio que coincida
+
+        Si la interaccion grabada tiene huella del cuerpo, el cuerpo enviado debe coincidir.
+        """
+        metodo = metodo.upper()
+        url = redactar_url(url)
+        candidatos = [i for i in range(len(self.interacciones)) if i not in self.usadas
+                      and self.interacciones[i]['metodo'] == metodo]
+        exactos = [i for i in candidatos if self.interacciones[i]['url'] == url]
+        # Si se reproduce otro dia solo puede cambiar la fecha del nombre de la hoja
+        sin_fecha = PATRON_HOJA_CON_FECHA.sub('Pacientes_FECHA', url)
+        por_fecha = [i for i in candidatos
+                     if PATRON_HOJA_CON_FECHA.sub('Pacientes_FECHA', self.interacciones[i]['url']) == sin_fecha]
+        if not por_fecha:
+            raise KeyError(f"[{self.nombre}] No hay interaccion grabada para {metodo} {url}")
+
+        if cuerpo_peticion is not None and metodo in METODOS_ESCRITURA:
+            # Lo que se sube debe ser lo mismo que se grabo (casetes viejos sin huella no se comparan)
+            huella = self.huella_peticion(cuerpo_peticion)
+            exactos, por_fecha = [[i for i in grupo if self.interacciones[i].get('peticion_sha1', huella) == huella]
+                                  for grupo in (exactos, por_fecha)]
+            if not por_fecha:
+                raise KeyError(f"[{self.nombre}] {metodo} {url}: el cuerpo enviado es distinto al grabado")
+
+        if exactos:
+            idx = exactos[0]
+        else:
+            idx = por_fecha[0]
+            logging.info(f"[{self.nombre}] {metodo} {url} reproducido con la fecha grabada: {self.interacciones[idx]['url']}")
+
+        self.usadas.add(idx)
+        interaccion = self.interacciones[idx]
+        return interaccion['estado'], interaccion['encabezados'], base64.b64decode(interaccion['cuerpo_b64'])
+
+    def pendientes(self, metodo=None):
+        """Numero de intercambios grabados que aun no se han reproducido (opcionalmente de un metodo)"""
+        return sum(1 for i, interaccion in enumerate(self.interacciones)
+                   if i not in self.usadas and (metodo is None or interaccion['metodo'] == metodo.upper()))
+
+    def guardar(self):
+        """Escribe el casete en disco"""
+        os.makedirs(DIRECTORIO_CASETES, mode=0o700, exist_ok=True)
+        with open(os.open(self.ruta, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w', encoding='utf-8') as f:
+            json.dump({'fecha': self.fecha.isoformat(), 'interacciones': self.interacciones}, f, indent=1)
+        logging.info(f"Casete guardado: {self.ruta} ({len(self.interacciones)} interacciones)")
+        logging.warning(f"{self.ruta} contiene datos de pacientes: no compartir ni subir a repositorios")
+
+def abrir_casete(nombre):
+    """Devuelve el casete con el nombre dado (uno por proceso)"""
+    if nombre not in _casetes:
+        _casetes[nombre] = Casete(nombre)
+    return _casetes[nombre]
+
+def crear_sesion(nombre_casete):
+    """Crea una requests.Session que graba o reproduce segun MODO_GRABACION"""
+    import requests
+    from requests.structures import CaseInsensitiveDict
+
+    if not modo():
+        return requests.Session()
+
+    casete = abrir_casete(nombre_casete)
+
+    class SesionGrabada(requests.Session):
+        def request(self, method, url, *args, **kwargs):
+            if modo() == MODO_REPRODUCIR:
+                estado, encabezados, contenido = casete.reproducir(method, url)
+                response = requests.Response()
+                response.status_code = estado
+                response.headers = CaseInsensitiveDict(encabezados)
+                response._content = contenido
+                response.url = url
+                return response
+
+            response = super().request(method, url, *args, **kwargs)
+            casete.grabar(method, url, response.status_code, response.headers, response.content)
+            return response
+
+    return SesionGrabada()
+
+class HttpGrabado:
+    """Envoltorio tipo httplib2.Http para googleapiclient que graba o reproduce"""
+
+    def __init__(self, casete, http=None):
+        self.casete = casete
+        self.http = http
+
+    def request(self, uri, method='GET', body=None, headers=None, **kwargs):
+        import httplib2
+
+        if self.http is None:
+            estado, encabezados, contenido = self.casete.reproducir(method, uri, body)
+            return httplib2.Response(dict(encabezados, status=str(estado))), contenido
+
+        resp, contenido = self.http.request(uri, method=method, body=body, headers=headers, **kwargs)
+        self.casete.grabar(method, uri, resp.status, dict(resp), contenido, body)
+        return resp, contenido
+
+    def __getattr__(self, nombre):
+        return getattr(self.http, nombre)
+
+def construir_servicio_sheets(credentials, nombre_casete='sheets'):
+    """Construye el cliente de Sheets v4 con grabacion/reproduccion si esta activa"""
+    from googleapiclient.discovery import build
+
+    if not modo():
+        return build('sheets', 'v4', credentials=credentials)
+
+    casete = abrir_casete(nombre_casete)
+    if modo() == MODO_REPRODUCIR:
+        return build('sheets', 'v4', http=HttpGrabado(casete))
+
+    from google_auth_httplib2 import AuthorizedHttp
+    return build('sheets', 'v4', http=HttpGrabado(casete, AuthorizedHttp(credentials)))
+
+def grabar_archivo(nombre_casete, nombre_archivo, ruta):
+    """Graba un archivo obtenido por el navegador (las paginas de Selenium no pasan por HTTP propio)"""
+    if modo() != MODO_GRABAR:
+        return
+    with open(ruta, 'rb') as f:
+        contenido = f.read()
+    abrir_casete(nombre_casete).grabar(
+        'ARCHIVO', f"archivo://{nombre_archivo}", 200,
+        {'content-type': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'}, contenido
+    )
+
+def reproducir_archivo(nombre_casete, nombre_archivo, ruta):
+    """Escribe en `ruta` el archivo grabado con `grabar_archivo`"""
+    _, _, contenido = abrir_casete(nombre_casete).reproducir('ARCHIVO', f"archivo://{nombre_archivo}")
+    with open(ruta, 'wb') as f:
+        f.write(contenido)
+    return ruta
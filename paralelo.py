@@ -0,0 +1,28 @@
+"""
+Lectura de reportes en paralelo usando varios procesos
+El numero de procesos y el tamano de lote se configuran por variables de entorno
+"""
+
+import os
+import logging
+from concurrent.futures import ProcessPoolExecutor
+
+# Configuracion (0 = un proceso por nucleo)
+PARSEO_WORKERS = int(os.environ.get('PARSEO_WORKERS', '0'))
+PARSEO_CHUNKSIZE = int(os.environ.get('PARSEO_CHUNKSIZE', '1'))
+
+def mapear_en_paralelo(funcion, elementos, workers=None, chunksize=None):
+    """Aplica `funcion` a cada elemento en un pool de procesos, conservando el orden de entrada"""
+    elementos = list(elementos)
+    workers = workers if workers is not None else PARSEO_WORKERS
+    workers = min(workers or os.cpu_count() or 1, len(elementos))
+    chunksize = max(1, chunksize if chunksize is not None else PARSEO_CHUNKSIZE)
+
+    # Con un solo archivo o un solo proceso no vale la pena levantar el pool
+    if workers <= 1:
+        return [funcion(e) for e in elementos]
+
+    logging.info(f"Procesando {len(elementos)} archivos con {workers} procesos (lotes de {chunksize})")
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # map devuelve los resultados en el orden de `elementos`, no en el de finalizacion
+        return list(executor.map(funcion, elementos, chunksize=chunksize))
@@ -0,0 +1,291 @@
+"""
+Script de sondeo intradia de pacientes atendidos
+Mantiene abierta la sesion de SUNUBE de cada cuenta, descarga el reporte de hoy cada N minutos
+y agrega a la hoja del dia solo las filas que aun no se habian enviado (values.append)
+"""
+
+import os
+import time
+import hashlib
+import logging
+from collections import Counter
+from datetime import datetime
+from googleapiclient.errors import HttpError
+from descargar_pacientes_github import CUENTAS, configurar_chrome, hacer_login, descargar_reporte_pacientes
+from upload_to_sheets import obtener_credenciales, leer_tabla, nombre_hoja, leer_hojas_tipadas
+from tabla_pacientes import TablaPacientes, a_texto
+from combinacion import (
+    combinar_tablas, normalizar_encabezado, procedencia_de_archivo, COLUMNA_DOCTOR, COLUMNA_ARCHIVO, COLUMNA_FECHA_REPORTE
+)
+from grabacion import modo, MODO_REPRODUCIR, construir_servicio_sheets, grabar_archivo, reproducir_archivo, abrir_casete
+
+# Configuracion
+INTERVALO_SONDEO_MINUTOS = float(os.environ.get('INTERVALO_SONDEO_MINUTOS', '15'))
+DURACION_SONDEO_HORAS = float(os.environ.get('DURACION_SONDEO_HORAS', '5.5'))
+
+# Columnas que no identifican al paciente atendido (no cuentan para detectar filas nuevas)
+COLUMNAS_SIN_HUELLA = {normalizar_encabezado(COLUMNA_ARCHIVO), normalizar_encabezado(COLUMNA_FECHA_REPORTE)}
+# Identidad estable de una atencion: doctor, documento del paciente y columnas de fecha/hora de la cita
+COLUMNA_DOCUMENTO = 'documento'
+PREFIJOS_CITA = ('fecha', 'hora')
+
+def proyectar_filas(tabla, encabezado):
+    """Ordena las filas de la tabla segun el encabezado de la hoja (columnas por nombre)"""
+    posiciones = {normalizar_encabezado(n): i for i, n in enumerate(tabla.nombres)}
+    indices = [posiciones.get(normalizar_encabezado(n)) for n in encabezado]
+    tabla_sheets = tabla.filas_sheets()[1:]
+    tipadas = list(tabla.filas())
+    return [
+        ([fila[i] if i is not None else None for i in indices],
+         [fila_sheets[i] if i is not None else "" for i in indices])
+        for fila, fila_sheets in zip(tipadas, tabla_sheets)
+    ]
+
+def _es_columna_identidad(clave):
+    """Indica si la columna (ya normalizada) forma parte de la identidad de una atencion"""
+    if clave in COLUMNAS_SIN_HUELLA:
+        return False
+    return clave in (normalizar_encabezado(COLUMNA_DOCTOR), COLUMNA_DOCUMENTO) or clave.startswith(PREFIJOS_CITA)
+
+def _texto_huella(valor):
+    """Texto de un valor para la huella: 1200.0 y 1200 son el mismo numero
+
+    Sheets devuelve los decimales sin parte fraccionaria como enteros, asi que un reporte
+    con la columna decimal y la hoja leida de vuelta deben dar la misma huella.
+    """
+    if isinstance(valor, float) and valor.is_integer():
+        return a_texto(int(valor))
+    return a_texto(valor)
+
+def huella(fila_tipada, encabezado):
+    """Huella de una fila a partir de sus valores tipados (independiente del formato de Sheets)
+
+    Si el reporte trae documento, la huella es doctor + documento + fecha/hora de la cita, asi que
+    corregir otra columna en SUNUBE no reenvia la fila; la correccion llega con la reescritura
+    completa de la hoja que hace el flujo diario a la manana siguiente. Sin columna de documento
+    se usan todas las celdas, y una fila editada en SUNUBE se vuelve a agregar como nueva.
+    """
+    claves = [normalizar_encabezado(n) for n in encabezado]
+    if COLUMNA_DOCUMENTO in claves:
+        incluir = _es_columna_identidad
+    else:
+        incluir = lambda clave: clave not in COLUMNAS_SIN_HUELLA
+    # Solo celdas con valor: agregar una columna vacia al encabezado no cambia la huella
+    partes = sorted(
+        f"{clave}={_texto_huella(v)}"
+        for clave, v in zip(claves, fila_tipada)
+        if v is not None and incluir(clave)
+    )
+    return hashlib.sha1("\x1f".join(partes).encode('utf-8')).hexdigest()
+
+class EstadoHoja:
+    """Encabezado de la hoja del dia y huellas de las filas ya enviadas"""
+
+    def __init__(self, service, sheet_id, fecha):
+        self.service = service
+        self.sheet_id = sheet_id
+        self.titulo = nombre_hoja(fecha)
+        self.encabezado = []
+        self.enviadas = Counter()
+        self.existe = False
+        self._cargar()
+
+    def _cargar(self):
+        """Lee una sola vez la hoja (si existe) para no reenviar filas tras un reinicio"""
+        # Valores nativos (fechas por su formato, no por el locale de la hoja): la huella de lo
+        # leido coincide con la de las filas tipadas del reporte
+        try:
+            hojas = leer_hojas_tipadas(self.service, self.sheet_id, [self.titulo])
+        except HttpError as e:
+            if "Unable to parse range" in str(e):
+                logging.info(f"Hoja {self.titulo} aun no existe, se creara con el primer envio")
+                return
+            raise
+
+        self.existe = True
+        tabla = TablaPacientes.desde_filas(hojas.get(self.titulo, []))
+        self.encabezado = list(tabla.nombres)
+        for fila_tipada, _ in proyectar_filas(tabla, self.encabezado):
+            self.enviadas[huella(fila_tipada, self.encabezado)] += 1
+        logging.info(f"Hoja {self.titulo}: {sum(self.enviadas.values())} filas ya enviadas")
+
+    def _asegurar_encabezado(self, tabla):
+        """Crea la hoja o agrega al encabezado las columnas nuevas del reporte"""
+        conocidas = {normalizar_encabezado(n) for n in self.encabezado}
+        nuevas = [n for n in tabla.nombres if normalizar_encabezado(n) not in conocidas]
+        if not nuevas and self.existe:
+            return
+
+        if not self.existe:
+            self.service.spreadsheets().batchUpdate(
+                spreadsheetId=self.sheet_id,
+                body={'requests': [{'addSheet': {'properties': {'title': self.titulo}}}]}
+            ).execute()
+            self.existe = True
+            logging.info(f"Nueva hoja creada: {self.titulo}")
+
+        self.encabezado.extend(nuevas)
+        self.service.spreadsheets().values().update(
+            spreadsheetId=self.sheet_id,
+            range=f"{self.titulo}!A1",
+            valueInputOption='RAW',
+            body={'values': [self.encabezado]}
+        ).execute()
+        logging.info(f"Encabezado de {self.titulo} actualizado: {nuevas}")
+
+    def anexar_nuevas(self, tabla):
+        """Agrega a la hoja solo las filas que no se han enviado; devuelve cuantas"""
+        if not tabla.nombres:
+            return 0
+        self._asegurar_encabezado(tabla)
+
+        vistas = Counter()
+        nuevas = []
+        for fila_tipada, fila_sheets in proyectar_filas(tabla, self.encabezado):
+            h = huella(fila_tipada, self.encabezado)
+            vistas[h] += 1
+            # Filas identicas repetidas cuentan por separado (mismo paciente atendido dos veces)
+            if vistas[h] > self.enviadas[h]:
+                nuevas.append((h, fila_sheets))
+
+        if not nuevas:
+            return 0
+
+        self.service.spreadsheets().values().append(
+            spreadsheetId=self.sheet_id,
+            range=f"{self.titulo}!A1",
+            valueInputOption='USER_ENTERED',
+            insertDataOption='INSERT_ROWS',
+            body={'values': [fila for _, fila in nuevas]}
+        ).execute()
+        for h, _ in nuevas:
+            self.enviadas[h] += 1
+        return len(nuevas)
+
+class SesionCuenta:
+    """Navegador con sesion iniciada en SUNUBE, reutilizado entre sondeos"""
+
+    def __init__(self, cuenta):
+        self.cuenta = cuenta
+        self.driver = None
+
+    def _iniciar(self):
+        self.cerrar()
+        self.driver = configurar_chrome()
+        hacer_login(self.driver, self.cuenta["email"], self.cuenta["password"], self.cuenta["nombre"])
+
+    def descargar(self, fecha):
+        """Descarga el reporte de la fecha; vuelve a iniciar sesion una vez si expiro"""
+        nombre = self.cuenta["nombre"]
+        if modo() == MODO_REPRODUCIR:
+            # Sin navegador: cada sondeo consume el siguiente reporte grabado de la cuenta
+            nombre_archivo = f"reporte_pacientes_{nombre}.xlsx"
+            return reproducir_archivo('sondeo', nombre_archivo, nombre_archivo)
+
+        if self.driver is None:
+            self._iniciar()
+        try:
+            archivo = descargar_reporte_pacientes(self.driver, nombre, fecha)
+        except Exception as e:
+            logging.warning(f"[{nombre}] Fallo con la sesion actual ({e}), reintentando login...")
+            self._iniciar()
+            archivo = descargar_reporte_pacientes(self.driver, nombre, fecha)
+
+        if archivo:
+            grabar_archivo('sondeo', os.path.basename(archivo), archivo)
+        return archivo
+
+    def cerrar(self):
+        if self.driver:
+            self.driver.quit()
+            self.driver = None
+
+def leer_reportes_de_hoy(sesiones, fecha):
+    """Descarga y lee el reporte de cada cuenta; devuelve la tabla combinada"""
+    fuentes = []
+    for sesion in sesiones:
+        nombre = sesion.cuenta["nombre"]
+        try:
+            archivo = sesion.descargar(fecha)
+        except Exception as e:
+            logging.error(f"[{nombre}] Error en la descarga: {e}")
+            continue
+        if not archivo:
+            logging.warning(f"[{nombre}] Sin reporte en este sondeo")
+            continue
+
+        # Se lee y se borra siempre (aunque falle la lectura): la siguiente descarga toma el
+        # .xlsx mas reciente y un archivo viejo quedaria con el nombre de otra cuenta
+        try:
+            fuentes.append((leer_tabla(archivo), procedencia_de_archivo(archivo, fecha.date())))
+        except Exception as e:
+            logging.error(f"[{nombre}] Error leyendo {archivo}: {e}")
+        finally:
+            if os.path.exists(archivo):
+                os.remove(archivo)
+    return combinar_tablas(fuentes)
+
+def main():
+    """Funcion principal"""
+    logging.info("="*60)
+    logging.info("SONDEO INTRADIA DE PACIENTES ATENDIDOS")
+    logging.info(f"Cada {INTERVALO_SONDEO_MINUTOS} minutos durante {DURACION_SONDEO_HORAS} horas")
+    logging.info("="*60)
+
+    sesiones = [SesionCuenta(c) for c in CUENTAS]
+    try:
+        sheet_id = os.environ.get('GOOGLE_SHEET_ID')
+        if not sheet_id and modo() == MODO_REPRODUCIR:
+            sheet_id = "REPRODUCCION"
+        if not sheet_id:
+            raise ValueError("Variable GOOGLE_SHEET_ID no encontrada")
+
+        service = construir_servicio_sheets(obtener_credenciales(), 'sheets_sondeo')
+        reproduciendo = modo() == MODO_REPRODUCIR
+        fin = time.monotonic() + DURACION_SONDEO_HORAS * 3600
+        estado = None
+
+        while True:
+            # En reproduccion se termina cuando ya se consumieron todos los reportes grabados
+            if reproduciendo and not abrir_casete('sondeo').pendientes('ARCHIVO'):
+                logging.info("Reportes grabados agotados, fin de la reproduccion")
+                break
+
+            inicio = time.monotonic()
+            hoy = datetime.now()
+            # Un sondeo fallido (SUNUBE o Sheets caidos) no termina el proceso: se reintenta en el siguiente
+            try:
+                # Al cambiar de dia se empieza una hoja nueva
+                if estado is None or estado.titulo != nombre_hoja(hoy):
+                    estado = EstadoHoja(service, sheet_id, hoy)
+
+                tabla = leer_reportes_de_hoy(sesiones, hoy)
+                agregadas = estado.anexar_nuevas(tabla)
+                logging.info(f"Sondeo {hoy.strftime('%H:%M')}: {len(tabla)} filas en SUNUBE, {agregadas} nuevas enviadas a {estado.titulo}")
+            except Exception as e:
+                # En reproduccion un fallo es una diferencia con el casete: reintentar no la corrige
+                if reproduciendo:
+                    raise
+                logging.error(f"Sondeo {hoy.strftime('%H:%M')} fallido: {e}")
+
+            if reproduciendo:
+                continue
+            espera = INTERVALO_SONDEO_MINUTOS * 60 - (time.monotonic() - inicio)
+            if time.monotonic() + max(espera, 0) >= fin:
+                break
+            time.sleep(max(espera, 0))
+
+        logging.info("="*60)
+        logging.info("SONDEO FINALIZADO")
+        logging.info("="*60)
+
+    except Exception as e:
+        logging.error(f"Error: {e}")
+        exit(1)
+
+    finally:
+        for sesion in sesiones:
+            sesion.cerrar()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,308 @@
+"""
+Representacion columnar tipada de los reportes de pacientes
+Infiere el esquema a partir del encabezado y guarda cada columna con su tipo
+(fechas, enteros, decimales y textos internados) en lugar de una lista de strings por fila
+"""
+
+import csv
+import re
+import sys
+import bisect
+import itertools
+from datetime import datetime, date
+
+# Tipos de columna soportados
+TIPO_TEXTO = 'texto'
+TIPO_ENTERO = 'entero'
+TIPO_DECIMAL = 'decimal'
+TIPO_FECHA = 'fecha'
+TIPO_FECHA_HORA = 'fecha_hora'
+
+# Formatos de fecha que entrega SUNUBE (via LibreOffice o openpyxl)
+FORMATOS_FECHA = ['%Y-%m-%d', '%d/%m/%Y', '%d-%m-%Y', '%m/%d/%y']
+FORMATOS_FECHA_HORA = ['%Y-%m-%d %H:%M:%S', '%d/%m/%Y %H:%M:%S', '%d/%m/%Y %H:%M', '%Y-%m-%d %H:%M']
+
+# Columnas que parecen numericas pero son identificadores (no se deben convertir)
+PALABRAS_IDENTIFICADOR = ['documento', 'cedula', 'identificacion', 'telefono', 'celular', 'historia', 'id']
+
+PATRON_ENTERO = re.compile(r'^-?(0|[1-9][0-9]{0,14})$')
+PATRON_DIGITOS = re.compile(r'^-?\d+$')
+# Numero con separador de miles cada 3 digitos, uno por separador ('1.234.567', '1,234')
+PATRONES_MILES = {sep: re.compile(rf'^-?\d{{1,3}}(\{sep}\d{{3}})+$') for sep in '.,'}
+# Parte entera que con 3 digitos despues del separador puede ser de miles ('45' en '45.000')
+PATRON_AMBIGUO = re.compile(r'^-?[1-9]\d{0,2}$')
+
+def _parsear_fecha(valor, formatos, con_hora):
+    """Intenta convertir un texto a fecha con alguno de los formatos dados"""
+    for formato in formatos:
+        try:
+            fecha = datetime.strptime(valor, formato)
+            return fecha if con_hora else fecha.date()
+        except ValueError:
+            continue
+    return None
+
+def _parsear_decimal(valor):
+    """Convierte '45000.5', '45000,5', '45.000,5', '45,000.5' o '1.234.567' a float (None si no es numero)
+
+    El ultimo separador ('.' o ',') es el decimal, salvo que se repita (entonces es de miles).
+    Un unico separador con 1-3 digitos antes y exactamente 3 despues ('45.000', '45,000') es
+    ambiguo: en los reportes suele ser de miles (pesos colombianos, o '#,##0' exportado por
+    LibreOffice tal como se ve), asi que no se convierte y la columna queda como texto.
+    """
+    ultimo = max(valor.rfind('.'), valor.rfind(','))
+    if ultimo == -1:
+        return float(valor) if PATRON_ENTERO.match(valor) else None
+    separador = valor[ultimo]
+    parte_entera, decimales = valor[:ultimo], valor[ultimo + 1:]
+    if separador in parte_entera:
+        # Separador repetido: solo puede ser de miles
+        return float(valor.replace(separador, '')) if PATRONES_MILES[separador].match(valor) else None
+    if not decimales.isdigit():
+        return None
+
+    otro = ',' if separador == '.' else '.'
+    if otro in parte_entera:
+        if not PATRONES_MILES[otro].match(parte_entera):
+            return None
+    elif not PATRON_DIGITOS.match(parte_entera):
+        return None
+    elif len(decimales) == 3 and PATRON_AMBIGUO.match(parte_entera):
+        return None
+    return float(f"{parte_entera.replace(otro, '')}.{decimales}")
+
+def _limpiar_celda(valor):
+    """Celda vacia como "", textos sin espacios y valores nativos sin cambios"""
+    if valor is None:
+        return ""
+    if isinstance(valor, str):
+        return valor.strip()
+    return valor
+
+def _es_identificador(nombre):
+    """Indica si el nombre de la columna corresponde a un identificador"""
+    palabras = re.split(r'[^a-z0-9]+', nombre.lower())
+    return any(p in palabras for p in PALABRAS_IDENTIFICADOR)
+
+def _tipo_nativo(valores):
+    """Tipo de una columna con valores ya tipados (openpyxl, Sheets); TEXTO si se mezclan"""
+    if all(isinstance(v, datetime) for v in valores):
+        return TIPO_FECHA_HORA
+    if all(isinstance(v, date) and not isinstance(v, datetime) for v in valores):
+        return TIPO_FECHA
+    if all(isinstance(v, int) and not isinstance(v, bool) for v in valores):
+        return TIPO_ENTERO
+    if all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in valores):
+        return TIPO_DECIMAL
+    return TIPO_TEXTO
+
+def inferir_tipo(nombre, valores):
+    """Infiere el tipo de una columna a partir de su encabezado y sus valores"""
+    no_vacios = [v for v in valores if v != ""]
+    if not no_vacios:
+        return TIPO_TEXTO
+
+    # Valores nativos (no texto): se respeta su tipo en lugar de volver a inferirlo
+    if any(not isinstance(v, str) for v in no_vacios):
+        return _tipo_nativo(no_vacios)
+
+    if all(_parsear_fecha(v, FORMATOS_FECHA, False) for v in no_vacios):
+        return TIPO_FECHA
+    if all(_parsear_fecha(v, FORMATOS_FECHA_HORA, True) for v in no_vacios):
+        return TIPO_FECHA_HORA
+    if not _es_identificador(nombre):
+        if all(PATRON_ENTERO.match(v) for v in no_vacios):
+            return TIPO_ENTERO
+        if all(_parsear_decimal(v) is not None for v in no_vacios):
+            return TIPO_DECIMAL
+    return TIPO_TEXTO
+
+def convertir_valor(valor, tipo):
+    """Convierte un valor limpio (texto o nativo) al tipo de la columna (None si esta vacio)"""
+    if valor == "":
+        return None
+    if not isinstance(valor, str):
+        if tipo == TIPO_TEXTO:
+            return a_texto(valor)
+        return float(valor) if tipo == TIPO_DECIMAL else valor
+    if tipo == TIPO_FECHA:
+        return _parsear_fecha(valor, FORMATOS_FECHA, False)
+    if tipo == TIPO_FECHA_HORA:
+        return _parsear_fecha(valor, FORMATOS_FECHA_HORA, True)
+    if tipo == TIPO_ENTERO:
+        return int(valor)
+    if tipo == TIPO_DECIMAL:
+        return _parsear_decimal(valor)
+    # Los textos se internan: las categorias (EPS, sede, doctor...) comparten un solo objeto
+    return sys.intern(valor)
+
+class ColumnaConstante:
+    """Columna derivada con el mismo valor en todas las filas (no copia datos)"""
+
+    def __init__(self, valor, longitud):
+        self.valor = valor
+        self.longitud = longitud
+
+    def __len__(self):
+        return self.longitud
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self.valor] * len(range(*idx.indices(self.longitud)))
+        if idx < -self.longitud or idx >= self.longitud:
+            raise IndexError("indice fuera de rango")
+        return self.valor
+
+    def __iter__(self):
+        for _ in range(self.longitud):
+            yield self.valor
+
+class ColumnaPorTramos:
+    """Columna formada por tramos (listas o ColumnaConstante) encadenados sin copiar valores
+
+    La usa la combinacion de reportes: Doctor, Archivo Origen y Fecha Reporte quedan como un
+    tramo constante por archivo en lugar de un valor repetido por fila.
+    """
+
+    def __init__(self, tramos=None):
+        self.tramos = []
+        self.inicios = []
+        self.longitud = 0
+        for tramo in tramos or []:
+            self.extend(tramo)
+
+    def extend(self, valores):
+        """Agrega valores al final como un tramo (constantes iguales y contiguas se unen)"""
+        if isinstance(valores, ColumnaPorTramos):
+            for tramo in valores.tramos:
+                self.extend(tramo)
+            return
+        if not len(valores):
+            return
+        ultimo = self.tramos[-1] if self.tramos else None
+        if (isinstance(valores, ColumnaConstante) and isinstance(ultimo, ColumnaConstante)
+                and type(ultimo.valor) is type(valores.valor) and ultimo.valor == valores.valor):
+            self.tramos[-1] = ColumnaConstante(ultimo.valor, len(ultimo) + len(valores))
+        else:
+            self.tramos.append(valores)
+            self.inicios.append(self.longitud)
+        self.longitud += len(valores)
+
+    def convertir(self, funcion):
+        """Nueva columna con `funcion` aplicada a cada valor (los tramos constantes siguen constantes)"""
+        return ColumnaPorTramos(convertir_columna(t, funcion) for t in self.tramos)
+
+    def __len__(self):
+        return self.longitud
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(self.longitud))]
+        if idx < 0:
+            idx += self.longitud
+        if idx < 0 or idx >= self.longitud:
+            raise IndexError("indice fuera de rango")
+        tramo = bisect.bisect_right(self.inicios, idx) - 1
+        return self.tramos[tramo][idx - self.inicios[tramo]]
+
+    def __iter__(self):
+        return itertools.chain.from_iterable(self.tramos)
+
+def convertir_columna(valores, funcion):
+    """Aplica `funcion` a cada valor de una columna sin expandir las columnas constantes"""
+    if isinstance(valores, ColumnaConstante):
+        return ColumnaConstante(funcion(valores.valor), len(valores))
+    if isinstance(valores, ColumnaPorTramos):
+        return valores.convertir(funcion)
+    return [funcion(v) for v in valores]
+
+class TablaPacientes:
+    """Tabla columnar: un nombre, un tipo y una lista de valores por columna"""
+
+    def __init__(self, nombres=None, tipos=None, columnas=None):
+        self.nombres = list(nombres or [])
+        self.tipos = list(tipos or [])
+        self.columnas = list(columnas or [])
+
+    @classmethod
+    def desde_filas(cls, filas):
+        """Construye la tabla desde filas de texto o de valores nativos (la primera es el encabezado)"""
+        if not filas:
+            return cls()
+
+        encabezado = [str(_limpiar_celda(c)) for c in filas[0]]
+        cuerpo = [[_limpiar_celda(c) for c in f] for f in filas[1:]]
+        # Recortar columnas sin encabezado al final (celdas vacias de Excel)
+        while encabezado and encabezado[-1] == "" and all(
+            len(f) < len(encabezado) or f[len(encabezado) - 1] == "" for f in cuerpo
+        ):
+            encabezado.pop()
+
+        tabla = cls()
+        for idx, nombre in enumerate(encabezado):
+            valores = [f[idx] if idx < len(f) else "" for f in cuerpo]
+            tipo = inferir_tipo(nombre, valores)
+            tabla.nombres.append(sys.intern(nombre))
+            tabla.tipos.append(tipo)
+            tabla.columnas.append([convertir_valor(v, tipo) for v in valores])
+        return tabla
+
+    def __len__(self):
+        """Numero de filas de datos (sin encabezado)"""
+        return len(self.columnas[0]) if self.columnas else 0
+
+    def columna(self, nombre):
+        """Devuelve los valores de la columna con el nombre dado"""
+        return self.columnas[self.nombres.index(nombre)]
+
+    def filas(self):
+        """Itera las filas con valores tipados (sin encabezado)"""
+        return zip(*self.columnas) if self.columnas else iter([])
+
+    def a_filas(self):
+        """Lista de filas con encabezado y valores tipados (para openpyxl u otros destinos)"""
+        return [list(self.nombres)] + [list(f) for f in self.filas()]
+
+    def filas_sheets(self):
+        """Filas listas para Sheets con valueInputOption USER_ENTERED"""
+        convertidores = [_convertidor_sheets(t) for t in self.tipos]
+        data = [list(self.nombres)]
+        for fila in self.filas():
+            data.append([conv(v) for conv, v in zip(convertidores, fila)])
+        return data
+
+def _valor_sheets_texto(valor):
+    """Texto literal con USER_ENTERED: el apostrofo evita que Sheets lo convierta en
+    formula, numero, moneda, porcentaje, fecha o booleano ('$45.000', '(123)', 'TRUE', '50%')"""
+    if not valor:
+        return ""
+    return "'" + valor
+
+def _convertidor_sheets(tipo):
+    """Devuelve la funcion que convierte un valor tipado al formato de Sheets"""
+    if tipo == TIPO_FECHA:
+        return lambda v: v.strftime('%Y-%m-%d') if v is not None else ""
+    if tipo == TIPO_FECHA_HORA:
+        return lambda v: v.strftime('%Y-%m-%d %H:%M:%S') if v is not None else ""
+    if tipo in (TIPO_ENTERO, TIPO_DECIMAL):
+        return lambda v: v if v is not None else ""
+    return _valor_sheets_texto
+
+def a_texto(valor):
+    """Convierte un valor tipado de vuelta a texto internado"""
+    if valor is None:
+        return None
+    if isinstance(valor, datetime):
+        return sys.intern(valor.strftime('%Y-%m-%d %H:%M:%S'))
+    if isinstance(valor, date):
+        return sys.intern(valor.strftime('%Y-%m-%d'))
+    return sys.intern(str(valor))
+
+def escribir_csv(tabla, ruta):
+    """Escribe la tabla en un archivo CSV local"""
+    with open(ruta, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(tabla.nombres)
+        for fila in tabla.filas():
+            writer.writerow(["" if v is None else a_texto(v) for v in fila])
+    return ruta
@@ -8,10 +8,16 @@ import json
 import logging
 import csv
 import subprocess
+import tempfile
+import contextlib
+import multiprocessing
 from datetime import datetime, timedelta
 from google.oauth2 import service_account
-from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
+from tabla_pacientes import TablaPacientes
+from combinacion import combinar_tablas, procedencia_de_archivo
+from paralelo import mapear_en_paralelo
+from grabacion import modo, MODO_REPRODUCIR, construir_servicio_sheets
 
 # Configurar logging
 logging.basicConfig(
@@ -21,10 +27,16 @@ logging.basicConfig(
 
 # Configuracion
 SCOPES = ['https://www.googleapis.com/auth/spreadsheets']
+# Dia cero de los numeros de serie de fecha de Sheets
+EPOCA_SHEETS = datetime(1899, 12, 30)
 
 def obtener_credenciales():
     """Obtiene las credenciales de Google desde variable de entorno"""
     try:
+        # En reproduccion las respuestas salen del casete, no se necesitan credenciales
+        if modo() == MODO_REPRODUCIR:
+            return None
+
         creds_json = os.environ.get('GOOGLE_SHEETS_CREDENTIALS')
         if not creds_json:
             raise ValueError("Variable GOOGLE_SHEETS_CREDENTIALS no encontrada")
@@ -46,7 +58,8 @@ def encontrar_archivos_excel():
 
     # Preferir archivos individuales sobre el combinado (que puede estar vacio)
     individuales = [f for f in todos if 'combinado' not in f.lower()]
-    archivos = individuales if individuales else todos
+    # Orden por nombre de archivo (os.listdir no garantiza orden), el mismo del Excel combinado
+    archivos = sorted(individuales if individuales else todos)
 
     logging.info(f"Archivos encontrados: {archivos}")
     return archivos
@@ -64,7 +77,16 @@ def convertir_excel_a_csv(archivo_excel):
         ]
 
         logging.info(f"Convirtiendo Excel a CSV con LibreOffice...")
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=30)
+        with contextlib.ExitStack() as recursos:
+            timeout = 30
+            if multiprocessing.parent_process() is not None:
+                # Dentro del pool: LibreOffice no admite instancias en paralelo con el mismo perfil,
+                # asi que cada conversion usa un perfil temporal (se borra al terminar). Crear un
+                # perfil nuevo hace mas lento el arranque, por eso el tiempo limite es mayor
+                perfil = recursos.enter_context(tempfile.TemporaryDirectory(prefix='libreoffice_'))
+                cmd.insert(1, f'-env:UserInstallation=file://{perfil}')
+                timeout = 90
+            result = subprocess.run(cmd, capture_output=True, text=True, timeout=timeout)
 
         if result.returncode == 0:
             logging.info(f"Conversion exitosa: {csv_file}")
@@ -138,14 +160,73 @@ def leer_excel_robusto(archivo):
             logging.error(f"Error en fallback: {e2}")
             raise
 
+def leer_tabla(archivo):
+    """Lee un reporte como tabla columnar tipada"""
+    tabla = TablaPacientes.desde_filas(leer_excel_robusto(archivo))
+    logging.info(f"Esquema de {archivo}: {list(zip(tabla.nombres, tabla.tipos))}")
+    return tabla
+
+def _leer_tabla_archivo(archivo):
+    """Tarea de cada proceso: lee un reporte y devuelve su tabla columnar con su procedencia"""
+    logging.info(f"Procesando: {archivo}")
+    return leer_tabla(archivo), procedencia_de_archivo(archivo)
+
+def nombre_hoja(fecha):
+    """Nombre de la hoja diaria para una fecha (Pacientes_YYYY-MM-DD)"""
+    return f"Pacientes_{fecha.strftime('%Y-%m-%d')}"
+
+def _valor_celda(celda):
+    """Valor nativo de una celda de la API (las fechas salen de su formato, no del locale)"""
+    valor = celda.get('effectiveValue', {})
+    tipo_formato = celda.get('effectiveFormat', {}).get('numberFormat', {}).get('type')
+    if 'numberValue' in valor:
+        numero = valor['numberValue']
+        if tipo_formato == 'DATE':
+            return (EPOCA_SHEETS + timedelta(days=numero)).date()
+        if tipo_formato == 'DATE_TIME':
+            return EPOCA_SHEETS + timedelta(seconds=round(numero * 86400))
+        return int(numero) if float(numero).is_integer() else numero
+    if 'stringValue' in valor:
+        return valor['stringValue']
+    if 'boolValue' in valor:
+        return str(valor['boolValue']).upper()
+    return None
+
+def leer_hojas_tipadas(service, sheet_id, titulos):
+    """Lee hojas completas en una sola llamada con valores nativos; devuelve {titulo: filas}"""
+    respuesta = service.spreadsheets().get(
+        spreadsheetId=sheet_id,
+        ranges=[f"'{t}'" for t in titulos],
+        includeGridData=True,
+        fields='sheets(properties.title,data.rowData.values(effectiveValue,effectiveFormat.numberFormat.type))'
+    ).execute()
+
+    hojas = {}
+    for hoja in respuesta.get('sheets', []):
+        filas = []
+        for bloque in hoja.get('data', []):
+            for fila in bloque.get('rowData', []):
+                valores = [_valor_celda(c) for c in fila.get('values', [])]
+                # Filas totalmente vacias (formato sin datos) no aportan nada
+                if any(v is not None for v in valores):
+                    filas.append(valores)
+        hojas[hoja['properties']['title']] = filas
+    return hojas
+
 def subir_a_sheets(credentials, sheet_id, data):
-    """Sube los datos a Google Sheets"""
+    """Sube los datos a Google Sheets (TablaPacientes con tipos, o lista de filas en RAW)"""
     try:
-        service = build('sheets', 'v4', credentials=credentials)
+        # Las tablas tipadas se suben con USER_ENTERED para que Sheets conserve fechas y numeros
+        if isinstance(data, TablaPacientes):
+            value_input_option = 'USER_ENTERED'
+            data = data.filas_sheets()
+        else:
+            value_input_option = 'RAW'
+
+        service = construir_servicio_sheets(credentials)
 
         # Nombre de la hoja con fecha de ayer (los datos son de ayer)
-        fecha_ayer = (datetime.now() - timedelta(days=1)).strftime("%Y-%m-%d")
-        sheet_name = f"Pacientes_{fecha_ayer}"
+        sheet_name = nombre_hoja(datetime.now() - timedelta(days=1))
 
         # Crear nueva hoja
         try:
@@ -182,7 +263,7 @@ def subir_a_sheets(credentials, sheet_id, data):
         result = service.spreadsheets().values().update(
             spreadsheetId=sheet_id,
             range=f"{sheet_name}!A1",
-            valueInputOption='RAW',
+            valueInputOption=value_input_option,
             body=body
         ).execute()
 
@@ -205,6 +286,8 @@ def main():
     try:
         # Obtener ID de la hoja
         sheet_id = os.environ.get('GOOGLE_SHEET_ID')
+        if not sheet_id and modo() == MODO_REPRODUCIR:
+            sheet_id = "REPRODUCCION"
         if not sheet_id:
             raise ValueError("Variable GOOGLE_SHEET_ID no encontrada")
 
@@ -215,27 +298,9 @@ def main():
 
         # Encontrar y leer archivos Excel (individuales por cuenta)
         archivos = encontrar_archivos_excel()
-        data = []
-        for archivo in archivos:
-            logging.info(f"Procesando: {archivo}")
-            # Extraer nombre del doctor del archivo (reporte_pacientes_Daniel.xlsx -> Daniel)
-            nombre_base = os.path.splitext(archivo)[0]
-            doctor = nombre_base.split('_')[-1] if '_' in nombre_base else "Desconocido"
-
-            archivo_data = leer_excel_robusto(archivo)
-            if not data:
-                # Primer archivo: agregar columna "Doctor" al encabezado
-                if archivo_data:
-                    archivo_data[0].append("Doctor")
-                    for fila in archivo_data[1:]:
-                        fila.append(doctor)
-                data = archivo_data
-            else:
-                # Archivos posteriores: saltar encabezado, agregar columna Doctor
-                filas = archivo_data[1:] if len(archivo_data) > 1 else archivo_data
-                for fila in filas:
-                    fila.append(doctor)
-                data.extend(filas)
+        # Cada proceso devuelve una tabla columnar (serializada al volver), en el orden de `archivos`;
+        # se combinan alineando columnas por encabezado y agregando Doctor/Archivo/Fecha Reporte
+        data = combinar_tablas(mapear_en_paralelo(_leer_tabla_archivo, archivos))
         logging.info(f"Total filas combinadas: {len(data)}")
 
         # Subir a Google Sheets